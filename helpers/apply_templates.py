@@ -6,14 +6,31 @@
 
 Usage:
 
-  ./apply_templates.py modeldat xspecver outcompiled outpython
+  ./apply_templates.py modeldat xspecver outcompiled outpython [nshards]
+  ./apply_templates.py --batch modeldat specfile
 
 This uses the model.dat file to identify what models and parameters
 are needed to create the python and C++ code. The xspecver argument
 is the XSPEC version string (e.g. "12.14.1" or "12.14.1c").
 
+When nshards is greater than 1 (the default is 1) the model bindings
+are split across nshards files, to reduce the compile time, which
+are named after outcompiled with "_<n>" added to the stem (so
+xspec_0.cxx, xspec_1.cxx, ... for xspec.cxx).
+
+The --batch form creates the code for several XSPEC versions while
+only parsing the model.dat file, and reading the templates, once. The
+specfile is a JSON file containing a list of objects with the keys
+"xspecver", "out_compiled", "out_python", and optionally "nshards".
+
+The parsed model.dat file, and a hash of the inputs, are stored in
+the .cache/ directory next to the compiled output, so that the output
+files are not re-created if nothing has changed.
+
 """
 
+from concurrent.futures import ThreadPoolExecutor
+import json
 from pathlib import Path
 import sys
 
@@ -21,53 +38,129 @@ import sys
 import template
 
 
-def doit(modeldat: str,
-         xspecver: str,
-         *,
-         out_python: str,
-         out_compiled: str
-         ) -> None:
-
-    modelfile = Path(modeldat)
-    models, unsupported = template.find_models(modelfile)
+def get_templates() -> tuple[Path, Path, Path]:
+    """Return the compiled, compiled-models, and python templates."""
 
     template_dir = Path('template')
     template_compiled = template_dir / 'xspec.cxx'
+    template_shard = template_dir / 'xspec_models.cxx'
     template_python = template_dir / '__init__.py'
-    for temp in [template_compiled, template_python]:
+    for temp in [template_compiled, template_shard, template_python]:
         if not temp.is_file():
             raise ValueError(f"Unable to find template: {temp}")
 
-    # Check that the directories exist. This is ugly and potentially
-    # dangerous.
-    #
+    return template_compiled, template_shard, template_python
+
+
+def create(modelfile: Path,
+           models: list[template.ModelDefinition],
+           xspecver: str,
+           *,
+           out_python: str,
+           out_compiled: str,
+           nshards: int = 1
+           ) -> None:
+    """Create the code for a single XSPEC version."""
+
     outc = Path(out_compiled).resolve()
     outp = Path(out_python).resolve()
-    for out in [outc, outp]:
-        if out.exists():
-            continue
+    outshards = template.get_shard_files(outc, nshards)
+    cachedir = outc.parent / '.cache'
 
-        for parent in reversed(out.parents):
-            if parent.is_dir():
-                continue
+    template_compiled, template_shard, template_python = get_templates()
 
-            parent.mkdir()
+    # Is there any need to re-create the output?
+    #
+    hashval = template.output_hash(modelfile,
+                                   [template_compiled, template_shard,
+                                    template_python],
+                                   xspecver, nshards)
+    if template.is_up_to_date(hashval, cachedir, [outc, outp] + outshards):
+        print(f"Skipping creation of {outc} and {outp} as unchanged")
+        return
+
+    # Ensure the output directories exist (they are normally the
+    # same directory, so only create each one once).
+    #
+    for outdir in {outc.parent, outp.parent}:
+        outdir.mkdir(parents=True, exist_ok=True)
 
-    # Create the code we want to compile
+    # Create the code we want to compile. The two outputs are
+    # independent, so they can be created at the same time (threads
+    # are not available on all platforms).
     #
-    template.apply_compiled(models, template_compiled, outc)
-    template.apply_python(modelfile, models, template_python,
-                          xspecver, outp)
+    if sys.platform == 'emscripten':
+        template.apply_compiled(models, template_compiled, outc,
+                                template_shard, outshards)
+        template.apply_python(modelfile, models, template_python,
+                              xspecver, outp)
+    else:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            jobs = [executor.submit(template.apply_compiled, models,
+                                    template_compiled, outc,
+                                    template_shard, outshards),
+                    executor.submit(template.apply_python, modelfile,
+                                    models, template_python, xspecver,
+                                    outp)]
+
+            # Ensure any error is raised.
+            for job in jobs:
+                job.result()
+
+    template.write_hash(hashval, cachedir)
+
+
+def doit(modeldat: str,
+         xspecver: str,
+         *,
+         out_python: str,
+         out_compiled: str,
+         nshards: int = 1
+         ) -> None:
+
+    doit_batch(modeldat, [{"xspecver": xspecver,
+                           "out_python": out_python,
+                           "out_compiled": out_compiled,
+                           "nshards": nshards}])
+
+
+def doit_batch(modeldat: str,
+               specs: list[dict[str, str]]
+               ) -> None:
+    """Create the code for each spec, which has the keys xspecver,
+    out_python, out_compiled, and (optionally) nshards."""
+
+    if len(specs) == 0:
+        raise ValueError("No output has been specified")
+
+    modelfile = Path(modeldat)
+    cachedir = Path(specs[0]["out_compiled"]).resolve().parent / '.cache'
+    models, unsupported = template.find_models(modelfile, cachedir)
+
+    for spec in specs:
+        create(modelfile, models, spec["xspecver"],
+               out_python=spec["out_python"],
+               out_compiled=spec["out_compiled"],
+               nshards=spec.get("nshards", 1))
 
     template.report(models, unsupported)
 
 
 if __name__ == "__main__":
 
-    if len(sys.argv) != 5:
-        sys.stderr.write(f"Usage: {sys.argv[0]} modeldat xspecver outcompiled outpython\n")
+    if len(sys.argv) == 4 and sys.argv[1] == "--batch":
+        with open(sys.argv[3], mode="rt") as ifh:
+            specs = json.load(ifh)
+
+        doit_batch(sys.argv[2], specs)
+        sys.exit(0)
+
+    if len(sys.argv) not in [5, 6]:
+        sys.stderr.write(f"Usage: {sys.argv[0]} modeldat xspecver outcompiled outpython [nshards]\n")
+        sys.stderr.write(f"       {sys.argv[0]} --batch modeldat specfile\n")
         sys.exit(1)
 
     doit(sys.argv[1], sys.argv[2],
          out_compiled=sys.argv[3],
-         out_python=sys.argv[4])
+         out_python=sys.argv[4],
+         nshards=int(sys.argv[5]) if len(sys.argv) == 6 else 1)
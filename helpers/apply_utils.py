@@ -17,26 +17,39 @@ we also want the same code included in the module.
 """
 
 from pathlib import Path
+import shutil
 import sys
 
 
+TOKEN = b"#@@START@@\n"
+
+# The size of the buffer used to copy the files.
+BUFSIZE = 1 << 20
+
+
 def doit(infile1, infile2, outfile):
 
-    out = Path(infile1).read_text()
-    out += "\n\n"
+    with open(infile2, mode='rb') as ifh2:
+
+        # Skip the infile2 contents up to, and including, the token
+        # (which, as it ends in a newline, must end a line).
+        #
+        for line in ifh2:
+            if line.endswith(TOKEN):
+                break
+        else:
+            raise ValueError(f"Unable to find start token in {infile2}")
 
-    # Extract the infile2 contents
-    intext = Path(infile2).read_text()
-    token = "#@@START@@\n"
-    idx = intext.find(token)
-    if idx == -1:
-        raise ValueError(f"Unable to find start token in {infile2}")
+        # The character after the token is also dropped.
+        ifh2.read(1)
 
-    out += intext[idx + len(token) + 1:]
+        outpath = Path(outfile)
+        with outpath.open(mode='wb', buffering=BUFSIZE) as ofh:
+            with open(infile1, mode='rb') as ifh1:
+                shutil.copyfileobj(ifh1, ofh, BUFSIZE)
 
-    outpath = Path(outfile)
-    with outpath.open(mode='wt') as ofh:
-        ofh.write(out)
+            ofh.write(b"\n\n")
+            shutil.copyfileobj(ifh2, ofh, BUFSIZE)
 
 
 if __name__ == "__main__":
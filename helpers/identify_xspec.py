@@ -18,6 +18,10 @@ import re
 import subprocess
 
 
+# Split the micro version into the number and patch level (e.g. "1c").
+MICRO_RE = re.compile(r"^(\d+)(.*)$")
+
+
 def get_compiler() -> str:
     """Guess the C++ compiler to use.
 
@@ -99,7 +103,7 @@ def get_xspec_macros(base):
     xspec_major = toks[0]
     xspec_minor = toks[1]
 
-    match = re.match(r"^(\d+)(.*)$", toks[2])
+    match = MICRO_RE.match(toks[2])
     xspec_micro = match[1]
     xspec_patch = None if match[2] == "" else match[2]
 
@@ -10,9 +10,17 @@ Jinja2?
 
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+from collections import Counter
+from functools import cache
+import hashlib
+from importlib import metadata
+import os
 from pathlib import Path
+import pickle
+import re
 import sys
 from typing import Sequence
+import zlib
 
 from parse_xspec.models import ModelDefinition, \
     parse_xspec_model_description
@@ -20,50 +28,236 @@ from parse_xspec.models import ModelDefinition, \
 import xspec_models_cxc_helpers as xu
 
 
-def replace_term(txt: str, term: str, replace: str) -> str:
-    """Replace the first term with replace in txt"""
+# The terms that can be replaced in the templates.
+#
+PLACEHOLDER_RE = re.compile(rb'(@@(?:ADDMODELS|MULMODELS|CONMODELS|MODELS|'
+                            rb'REGISTERMODELS|SHARD|'
+                            rb'MODELDAT|PYINFO|XSPECVER)@@)')
 
-    idx = txt.find(term)
-    if idx < 0:
-        sys.stderr.write(f'ERROR: unable to find {term}\n')
-        sys.exit(1)
 
-    return txt[:idx] + replace + txt[idx + len(term):]
+@cache
+def read_template(template: Path) -> bytes:
+    """Return the template contents.
+
+    The contents are cached since the same template may be used to
+    create several outputs (e.g. for different XSPEC versions). The
+    text is not decoded as it is only ever copied to the output.
+    """
+
+    return template.read_bytes()
+
+
+def same_contents(file1: Path,
+                  file2: Path,
+                  bufsize: int = 1 << 20
+                  ) -> bool:
+    """Do the two files have the same contents?
+
+    A missing file is taken to be different. The files are read in
+    chunks of bufsize bytes.
+    """
+
+    try:
+        if file1.stat().st_size != file2.stat().st_size:
+            return False
+
+        with file1.open(mode='rb') as fh1, file2.open(mode='rb') as fh2:
+            while True:
+                chunk1 = fh1.read(bufsize)
+                if chunk1 != fh2.read(bufsize):
+                    return False
+
+                if not chunk1:
+                    return True
+
+    except OSError:
+        return False
+
+
+def write_template(template: Path,
+                   replacements: dict[str, str],
+                   outfile: Path
+                   ) -> None:
+    """Write out the template, replacing the first occurrence of each term.
+
+    The template is split at the terms (which must be matched by
+    PLACEHOLDER_RE) and the pieces are streamed to a temporary file,
+    rather than creating the full output in memory. The output file is
+    only replaced if the contents have changed, so that its
+    modification time does not change and it will not be re-compiled.
+    """
+
+    terms = {term.encode(): value.encode()
+             for term, value in replacements.items()}
+    parts = PLACEHOLDER_RE.split(read_template(template))
+
+    # The odd-numbered elements are the matched terms. Any term that
+    # is not being replaced is left as is.
+    #
+    found = set()
+    for idx in range(1, len(parts), 2):
+        term = parts[idx]
+        if term in found or term not in terms:
+            continue
+
+        found.add(term)
+        parts[idx] = terms[term]
+
+    for term in replacements:
+        if term.encode() not in found:
+            sys.stderr.write(f'ERROR: unable to find {term}\n')
+            sys.exit(1)
+
+    tmpfile = outfile.with_name(f"{outfile.name}.{os.getpid()}.tmp")
+    with tmpfile.open(mode='wb', buffering=1 << 20) as ofh:
+        ofh.writelines(parts)
+
+    if same_contents(tmpfile, outfile):
+        tmpfile.unlink()
+        return
+
+    os.replace(tmpfile, outfile)
+
+
+def get_shard_files(outfile: Path, nshards: int) -> list[Path]:
+    """The files used to compile the models when they are split up.
+
+    The names are outfile with the shard number added to the stem, and
+    there are no files when nshards is 1.
+    """
+
+    if nshards < 1:
+        raise ValueError(f"nshards must be >= 1, not {nshards}")
+
+    if nshards == 1:
+        return []
+
+    return [outfile.with_name(f"{outfile.stem}_{i}{outfile.suffix}")
+            for i in range(nshards)]
+
+
+# How are the wrappers called for each language: the suffix of the
+# wrapper template and the name of the model function.
+#
+WRAPPER_CALLS = {'Fortran - single precision': ('f', '{}_'),
+               'Fortran - double precision': ('F', '{}_'),
+               'C++ style': ('C', 'C_{}'),
+               'C style': ('C', '{}')}
+
+
+def wrapmodel_batch(model: ModelDefinition) -> str:
+    """Create the m.def line for the batched version of a model.
+
+    This is for additive and multiplicative models, and creates the
+    <name>_batch function which accepts a 2D array of parameters. There
+    are two versions: the second writes to the out argument.
+    """
+
+    suffix, fname = WRAPPER_CALLS[model.language]
+    npars = len(model.pars)
+    npars_str = xu.get_npars(npars)
+    label = {"Add": "additive", "Mul": "multiplicative"}[model.modeltype]
+    func = f'{fname.format(model.funcname)}, {npars}'
+
+    out = f'    m.def("{model.name}_batch", '
+    out += f'xspec_models_cxc::wrapper_batch_{suffix}<{func}>, '
+    out += f'"The XSPEC {label} {model.name} model ({npars_str}); batch.",'
+    out += '"pars"_a,"energies"_a,"spectrum"_a=1'
+    if suffix == 'C':
+        out += ',"initStr"_a=""'
+
+    out += ');\n'
+
+    out += f'    m.def("{model.name}_batch", '
+    out += f'xspec_models_cxc::wrapper_batch_inplace_{suffix}<{func}>, '
+    out += f'"The XSPEC {label} {model.name} model ({npars_str}); batch, inplace.",'
+    out += '"pars"_a,"energies"_a,"out"_a,"spectrum"_a=1'
+    if suffix == 'C':
+        out += ',"initStr"_a=""'
+
+    out += ',py::return_value_policy::reference);'
+    return out
+
+
+def wrapmodel_con_out(model: ModelDefinition) -> str:
+    """Create the m.def line for a convolution model with an out argument.
+
+    This adds a version of the model which does not change the model
+    argument but writes the result to out instead.
+    """
+
+    suffix, fname = WRAPPER_CALLS[model.language]
+    npars = len(model.pars)
+    npars_str = xu.get_npars(npars)
+
+    out = f'    m.def("{model.name}", '
+    out += f'xspec_models_cxc::wrapper_con_out_{suffix}<{fname.format(model.funcname)}, {npars}>, '
+    out += f'"The XSPEC convolution {model.name} model ({npars_str}); out.",'
+    out += '"pars"_a,"energies"_a,"model"_a,"out"_a,"spectrum"_a=1'
+    if suffix == 'C':
+        out += ',"initStr"_a=""'
+
+    out += ',py::return_value_policy::reference);'
+    return out
 
 
 def apply_compiled(models: Sequence[ModelDefinition],
                    template: Path,
-                   outfile: Path
+                   outfile: Path,
+                   shard_template: Path | None = None,
+                   shardfiles: Sequence[Path] = ()
                    ) -> None:
-    """Convert the template for the compiled code."""
+    """Convert the template for the compiled code.
 
-    addmodels = []
-    mulmodels = []
-    conmodels = []
+    If shardfiles is not empty then the model bindings are split
+    between these files, which are created from shard_template, and
+    outfile just calls the routines they define. The shard used for a
+    model depends only on its name, so adding or removing a model only
+    changes one shard file.
+    """
+
+    nshards = len(shardfiles)
+    descs: dict[str, list[str]] = {"Add": [], "Mul": [], "Con": []}
     mstrs = []
+    shards: list[list[str]] = [[] for _ in range(nshards)]
     for model in models:
         mdef, mtype, mdesc = xu.wrapmodel_compiled(model)
-        if mtype == "Add":
-            addmodels.append(mdesc)
-        elif mtype == "Mul":
-            mulmodels.append(mdesc)
-        elif mtype == "Con":
-            conmodels.append(mdesc)
+        descs[mtype].append(mdesc)  # a KeyError should not happen
+        if mtype == "Con":
+            mdef += '\n' + wrapmodel_con_out(model)
         else:
-            assert False  # should not happen
+            mdef += '\n' + wrapmodel_batch(model)
 
         mstrs.append(mdef)
+        if nshards > 0:
+            shards[zlib.crc32(model.name.encode()) % nshards].append(mdef)
+
+    if nshards == 0:
+        registers = ''
+        mdefs = '\n'.join(mstrs)
 
-    with template.open(mode='rt') as ifh:
-        out = ifh.read()
+    else:
+        if shard_template is None:
+            raise ValueError("shard_template must be set when using shardfiles")
 
-        out = replace_term(out, '@@ADDMODELS@@', '\n'.join(addmodels))
-        out = replace_term(out, '@@MULMODELS@@', '\n'.join(mulmodels))
-        out = replace_term(out, '@@CONMODELS@@', '\n'.join(conmodels))
-        out = replace_term(out, '@@MODELS@@', '\n'.join(mstrs))
+        decls = [f'void register_models_{i}(py::module_ &m);'
+                 for i in range(nshards)]
+        registers = '\n'.join(['namespace xspec_models_cxc {'] + decls + ['}'])
+        mdefs = '\n'.join(f'    xspec_models_cxc::register_models_{i}(m);'
+                          for i in range(nshards))
 
-    with outfile.open(mode='wt') as ofh:
-        ofh.write(out)
+        for i, shardfile in enumerate(shardfiles):
+            replacements = {'@@SHARD@@': str(i),
+                            '@@MODELS@@': '\n'.join(shards[i])}
+            write_template(shard_template, replacements, shardfile)
+
+    replacements = {'@@ADDMODELS@@': '\n'.join(descs["Add"]),
+                    '@@MULMODELS@@': '\n'.join(descs["Mul"]),
+                    '@@CONMODELS@@': '\n'.join(descs["Con"]),
+                    '@@REGISTERMODELS@@': registers,
+                    '@@MODELS@@': mdefs}
+
+    write_template(template, replacements, outfile)
 
 
 def apply_python(modelfile: Path,
@@ -85,29 +279,145 @@ def apply_python(modelfile: Path,
         mname, mdef = xu.wrapmodel_python(model)
         mstrs.append(f"    '{mname}': {mdef}")
 
-    with template.open(mode='rt') as ifh:
-        out = ifh.read()
+    replacements = {'@@MODELDAT@@': str(modelfile),
+                    '@@PYINFO@@': ',\n'.join(mstrs),
+                    '@@XSPECVER@@': xspec_version}
+
+    write_template(template, replacements, outfile)
+
+
+def parser_version() -> str:
+    """The version of the parse-xspec package."""
+
+    try:
+        return metadata.version("parse-xspec")
+    except metadata.PackageNotFoundError:
+        return "unknown"
 
-        out = replace_term(out, '@@MODELDAT@@', str(modelfile))
-        out = replace_term(out, '@@PYINFO@@', ',\n'.join(mstrs))
-        out = replace_term(out, '@@XSPECVER@@', xspec_version)
 
-    with outfile.open(mode='wt') as ofh:
-        ofh.write(out)
+def modelfile_key(modelfile: Path) -> tuple[str, int, int, str]:
+    """Identify the model.dat file and how it is parsed.
 
+    The key is the location, modification time, and size of the file,
+    together with the version of parse-xspec, since a new version may
+    parse the file differently.
+    """
+
+    st = modelfile.stat()
+    return str(modelfile.resolve()), st.st_mtime_ns, st.st_size, \
+        parser_version()
+
+
+def cached_parse(modelfile: Path,
+                 cachedir: Path | None = None
+                 ) -> list[ModelDefinition]:
+    """Parse the model.dat file, re-using the previous parse if possible.
+
+    The cache is keyed on the location, modification time, and size of
+    the model.dat file, and the parse-xspec version, so any change to
+    the file or parser will cause it to be re-parsed. A missing or
+    unreadable cache is not an error.
+    """
+
+    if cachedir is None:
+        return parse_xspec_model_description(modelfile)
+
+    key = modelfile_key(modelfile)
+    cachefile = cachedir / 'models.pkl'
+    try:
+        with cachefile.open(mode='rb') as ifh:
+            cachekey, allmodels = pickle.load(ifh)
+
+        if cachekey == key:
+            return allmodels
+
+    except Exception:
+        pass
+
+    allmodels = parse_xspec_model_description(modelfile)
 
-def find_models(modelfile: Path
+    cachedir.mkdir(parents=True, exist_ok=True)
+    with cachefile.open(mode='wb') as ofh:
+        pickle.dump((key, allmodels), ofh)
+
+    return allmodels
+
+
+def helpers_version() -> str:
+    """The version of the xspec-models-cxc-helpers package."""
+
+    try:
+        return metadata.version("xspec-models-cxc-helpers")
+    except metadata.PackageNotFoundError:
+        return getattr(xu, "__version__", "unknown")
+
+
+# The code used to create the output, which must be included in the
+# hash as changing it changes the output.
+#
+GENERATOR_FILES = [Path(__file__).resolve(),
+                   Path(__file__).resolve().with_name('apply_templates.py')]
+
+
+def output_hash(modelfile: Path,
+                templates: Sequence[Path],
+                xspec_version: str,
+                nshards: int = 1
+                ) -> str:
+    """A hash of the inputs used to create the module code.
+
+    The contents of the files are used, rather than their modification
+    times, so that re-installing an unchanged model.dat file does not
+    cause the code to be re-created (and hence re-compiled). The code
+    generator, and the versions of xspec-models-cxc-helpers and
+    parse-xspec, are also included.
+    """
+
+    header = f"{xspec_version}\n{nshards}\n{helpers_version()}\n" + \
+        f"{parser_version()}\n"
+    h = hashlib.sha256(header.encode())
+    for infile in [modelfile, *templates, *GENERATOR_FILES]:
+        h.update(infile.read_bytes())
+
+    return h.hexdigest()
+
+
+def is_up_to_date(hashval: str,
+                  cachedir: Path,
+                  outfiles: Sequence[Path]
+                  ) -> bool:
+    """Are the output files known to have been created from these inputs?"""
+
+    if not all(outfile.is_file() for outfile in outfiles):
+        return False
+
+    try:
+        return (cachedir / 'out.hash').read_text() == hashval
+    except OSError:
+        return False
+
+
+def write_hash(hashval: str, cachedir: Path) -> None:
+    """Record the hash of the inputs used to create the output files."""
+
+    cachedir.mkdir(parents=True, exist_ok=True)
+    (cachedir / 'out.hash').write_text(hashval)
+
+
+def find_models(modelfile: Path,
+                cachedir: Path | None = None
                 ) -> tuple[list[ModelDefinition], list[ModelDefinition]]:
     """Extract the models we can support from the model.dat file
 
-    The return values are the supported then unsupported models.
+    The return values are the supported then unsupported models. If
+    cachedir is set then the parsed model.dat file is cached there.
     """
 
     if not modelfile.is_file():
         sys.stderr.write(f'ERROR: unable to find model.dat file: {modelfile}.\n')
         sys.exit(1)
 
-    allmodels = parse_xspec_model_description(modelfile)
+    allmodels = cached_parse(modelfile, cachedir)
     if len(allmodels) == 0:
         sys.stderr.write(f'ERROR: unable to parse model.dat file: {modelfile}\n')
         sys.exit(1)
@@ -123,35 +433,41 @@ def find_models(modelfile: Path
 def report(models, unsupported):
     """Report on what models we are using and not using."""
 
-    print("###############################################")
-    print(f"Number of supported models:     {len(models)}")
-    print(f"          unsupported:          {len(unsupported)}")
-    print("")
+    # Create the report and then display it in one go.
+    #
+    out = ["###############################################",
+           f"Number of supported models:     {len(models)}",
+           f"          unsupported:          {len(unsupported)}",
+           ""]
+
+    # Count the model types and languages in one pass.
+    #
+    mtypes = Counter(m.modeltype for m in models)
+    langs = Counter(m.language for m in models)
 
     def count_type(label, mtype):
-        matches = [m for m in models if m.modeltype == mtype]
-        print(f"   {label:27s}  {len(matches)}")
+        out.append(f"   {label:27s}  {mtypes[mtype]}")
 
     def count_lang(label):
-        matches = [m for m in models if m.language == label]
-        print(f"   {label:27s}  {len(matches)}")
+        out.append(f"   {label:27s}  {langs[label]}")
 
     count_type("additive", "Add")
     count_type("multiplicative", "Mul")
     count_type("convolution", "Con")
-    print("")
+    out.append("")
 
     count_lang("C++ style")
     count_lang("C style")
     count_lang("Fortran - single precision")
     count_lang("Fortran - double precision")
-    print("")
+    out.append("")
 
     if len(unsupported) > 0:
-        print("Unsupported:")
+        out.append("Unsupported:")
         for i, mdl in enumerate(unsupported, 1):
-            print(f"   {i}. {mdl.name} - {mdl.modeltype}/{mdl.language}")
+            out.append(f"   {i}. {mdl.name} - {mdl.modeltype}/{mdl.language}")
 
-        print("")
+        out.append("")
 
-    print("###############################################")
+    out.append("###############################################")
+    sys.stdout.write("\n".join(out) + "\n")
@@ -27,6 +27,8 @@ plt.ylabel('Photon/cm$^2$/s')
 kdblur = x.info('kdblur')
 pars_kdblur = [p.default for p in kdblur.parameters]
 
-x.kdblur(energies=egrid, pars=pars_kdblur, model=ymodel)
-plt.plot(emid, ymodel, alpha=0.8, label='Convolved')
+# kdblur uses single-precision values
+yconv = ymodel.astype(np.float32)
+x.kdblur(energies=egrid, pars=pars_kdblur, model=yconv)
+plt.plot(emid, yconv, alpha=0.8, label='Convolved')
 plt.legend()
@@ -24,12 +24,19 @@ def add_version():
              horizontalalignment="left")
 
 
-egrid = np.arange(0.1, 20, 0.01)
-emid = (egrid[:-1] + egrid[1:]) / 2
-
-for kT in [0.1, 0.3, 0.5, 1, 3, 5, 10]:
-    y = x.apec(energies=egrid, pars=[kT, 1, 0])
-    plt.plot(emid, y, label=f'kT={kT}', alpha=0.6)
+# The plots use a logarithmic energy axis, so use logarithmically-spaced
+# bins. As the bin widths vary, the additive models are plotted per keV.
+#
+egrid = np.geomspace(0.1, 20, 401)
+emid = np.sqrt(egrid[:-1] * egrid[1:])
+de = np.diff(egrid)
+
+# Evaluate all the temperatures with a single call.
+#
+kTs = [0.1, 0.3, 0.5, 1, 3, 5, 10]
+ys = x.apec_batch(energies=egrid, pars=[[kT, 1, 0] for kT in kTs])
+for kT, y in zip(kTs, ys):
+    plt.plot(emid, y / de, label=f'kT={kT}', alpha=0.6)
 
 plt.xscale('log')
 plt.yscale('log')
@@ -37,7 +44,7 @@ plt.yscale('log')
 plt.legend()
 
 plt.xlabel('Energy (keV)')
-plt.ylabel('Photon/cm$^2$/s')
+plt.ylabel('Photon/cm$^2$/s/keV')
 plt.title('APEC model: Abundance=1 Redshift=0')
 add_version()
 
@@ -45,8 +52,9 @@ plt.savefig('example-additive.png')
 
 plt.clf()
 
-for nH in [0.01, 0.05, 0.1, 0.5, 1]:
-    y = x.phabs(energies=egrid, pars=[nH])
+nHs = [0.01, 0.05, 0.1, 0.5, 1]
+ys = x.phabs_batch(energies=egrid, pars=[[nH] for nH in nHs])
+for nH, y in zip(nHs, ys):
     plt.plot(emid, y, label=f'nH={nH}', alpha=0.6)
 
 plt.xscale('log')
@@ -64,12 +72,15 @@ plt.savefig('example-multiplicative.png')
 plt.clf()
 
 model = x.phabs(energies=egrid, pars=[0.05]) * x.apec(energies=egrid, pars=[0.5, 1, 0])
-plt.plot(emid, model, label='Unconvolved', c='k', alpha=0.8)
+plt.plot(emid, model / de, label='Unconvolved', c='k', alpha=0.8)
 
 for pars in [[0.1, 0], [0.2, -1], [0.2, 1]]:
-    # the model argument gets over-written by gsmooth, hence the copy
-    y = x.gsmooth(energies=egrid, pars=pars, model=model.copy())
-    plt.plot(emid, y, label=rf'$\sigma$={pars[0]} index={pars[1]}', alpha=0.8)
+    # the model argument would be over-written by gsmooth, so write
+    # the result to a new array (each line needs its own array, as
+    # matplotlib does not copy the data)
+    y = x.gsmooth(energies=egrid, pars=pars, model=model,
+                  out=np.empty_like(model))
+    plt.plot(emid, y / de, label=rf'$\sigma$={pars[0]} index={pars[1]}', alpha=0.8)
 
 plt.xscale('log')
 plt.yscale('log')
@@ -77,7 +88,7 @@ plt.yscale('log')
 plt.legend()
 
 plt.xlabel('Energy (keV)')
-plt.ylabel('Photon/cm$^2$/s')
+plt.ylabel('Photon/cm$^2$/s/keV')
 plt.title('GSMOOTH(PHABS * APEC)')
 add_version()
 
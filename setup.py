@@ -18,16 +18,23 @@ HEASARC/XSPEC installation within a conda-like environment.
 
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+from functools import cache
 import glob
+import hashlib
+import json
 import os
 from pathlib import Path
+import shutil
 import subprocess
 import sys
 import sysconfig
 
 from setuptools import setup
 
-from pybind11.setup_helpers import Pybind11Extension, build_ext
+from pybind11.setup_helpers import Pybind11Extension, ParallelCompile, \
+    build_ext, naive_recompile
+
+import xspec_models_cxc_helpers as xu
 
 # How do we use local modules like helpers? This is a hack based on
 # discussions around
@@ -36,10 +43,16 @@ from pybind11.setup_helpers import Pybind11Extension, build_ext
 # Note that we do not treat the helpers code as Python modules that
 # can be imported, but as code that has to be run and returns a
 # value. This is awkward, but may better separate the build logic from
-# the build implementation.
+# the build implementation. The simple queries - which just call
+# routines from xspec-models-cxc-helpers - are made directly, to
+# avoid starting a new Python process for each one. The template
+# module is imported so that the names of the generated files come
+# from one place.
 #
 sys.path.append(os.path.dirname(__file__))
 
+from helpers import template
+
 # How can we best set this up?
 __version__ = "0.1.0"
 
@@ -54,23 +67,40 @@ def helper(script: str, *args: str) -> list[str]:
 
 
 # Access the model.dat file. This also checks HEADAS is set up.
+# This is the same as helpers/report_xspec_modelfile.py.
 #
-modeldat = Path(helper("report_xspec_modelfile.py")[0])
+modeldat = Path(xu.get_xspec_model_path())
 
-# Where are the include and library directories for XSPEC?
+# Where are the include and library directories for XSPEC? This is
+# the same as helpers/report_xspec_directories.py.
 #
-dirs = helper("report_xspec_directories.py")
-xspec_inc_dir = Path(dirs[0])
-xspec_lib_dir = Path(dirs[1])
+xspec_inc_dir = Path(xu.get_xspec_include_path())
+xspec_lib_dir = Path(xu.get_xspec_library_path())
 
 # What are the libraries we need to use to compile against XSPEC? This
 # logic is the one that likely needs to change when there is a new
-# version (not patch) of XSPEC released.
+# version (not patch) of XSPEC released. This is the same as
+# helpers/report_xspec_libraries.py.
 #
-xspec_libs = helper("report_xspec_libraries.py", str(xspec_lib_dir))
+xspec_libs = xu.get_xspec_libs(xspec_lib_dir)
 
-# What version of XSPEC is in use?
+# What version of XSPEC is in use? Compiling and running the
+# report_xspec_version code takes time, so the result is cached in
+# VERSION_CACHE. The key depends on the XSPEC installation, the XSUtil
+# library, and the compiler, so the code is only re-compiled when one
+# of these changes.
 #
+VERSION_CACHE = Path('src/xspec_models_cxc/.cache/xspec_version.json')
+
+
+@cache
+def compiler_version(compiler: str) -> bytes:
+    """Return the output of `compiler --version`."""
+
+    args = [compiler, "--version"]
+    return subprocess.run(args, check=True, stdout=subprocess.PIPE).stdout
+
+
 def get_compiler() -> str:
     """Guess the C++ compiler to use.
 
@@ -85,10 +115,8 @@ def get_compiler() -> str:
     # Do not try anything too clever here.
     #
     for compiler in ["g++", "clang++"]:
-        args = [compiler, "--version"]
-
         try:
-            subprocess.run(args, check=True)
+            compiler_version(compiler)
             return compiler
         except (FileNotFoundError, subprocess.CalledProcessError):
             pass
@@ -96,13 +124,12 @@ def get_compiler() -> str:
     raise ValueError("Use the CXX environment variable to select the C++ compiler to use")
 
 
-def compile_code(inc_path, lib_path):
+def compile_code(compiler, inc_path, lib_path):
     """Compile the code. Specific to report_xspec_version."""
 
     basename = "report_xspec_version"
     helpers = Path("helpers")
 
-    compiler = get_compiler()
     print(f"** Using compiler: {compiler}")
     args = [compiler,
             str(helpers / f"{basename}.cxx"),
@@ -117,12 +144,48 @@ def compile_code(inc_path, lib_path):
     return helpers / basename
 
 
-compiled = compile_code(inc_path=xspec_inc_dir,
-                        lib_path=xspec_lib_dir)
+def version_key(compiler, lib_path) -> str:
+    """Identify the XSPEC installation and compiler."""
+
+    headas = Path(os.environ["HEADAS"]).resolve()
+    parts = [str(headas), compiler,
+             hashlib.sha256(compiler_version(compiler)).hexdigest()]
+    for lib in sorted(Path(lib_path).glob("libXSUtil*")):
+        parts.append(f"{lib.name} {lib.stat().st_mtime_ns}")
+
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
 
-proc = subprocess.run([str(compiled)], check=True,
-                      stdout=subprocess.PIPE, text=True)
-xspec_version = proc.stdout.strip()
+def get_xspec_version(inc_path, lib_path) -> str:
+    """Return the XSPEC version, re-using the cached value if possible."""
+
+    compiler = get_compiler()
+    key = version_key(compiler, lib_path)
+    try:
+        cached = json.loads(VERSION_CACHE.read_text())
+        if cached["key"] == key:
+            return cached["version"]
+
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    compiled = compile_code(compiler, inc_path=inc_path, lib_path=lib_path)
+    proc = subprocess.run([str(compiled)], check=True,
+                          stdout=subprocess.PIPE, text=True)
+    version = proc.stdout.strip()
+
+    # Write to a temporary file and then move it, so that an
+    # interrupted build does not leave a partially-written cache.
+    #
+    VERSION_CACHE.parent.mkdir(parents=True, exist_ok=True)
+    tmpfile = VERSION_CACHE.with_name(f"{VERSION_CACHE.name}.{os.getpid()}")
+    tmpfile.write_text(json.dumps({"key": key, "version": version}))
+    os.replace(tmpfile, VERSION_CACHE)
+    return version
+
+
+xspec_version = get_xspec_version(inc_path=xspec_inc_dir,
+                                  lib_path=xspec_lib_dir)
 print(f"Building against XSPEC: '{xspec_version}'")
 
 macros = [('VERSION_INFO', __version__)]
@@ -139,11 +202,42 @@ if not include_dir.is_dir():
 # Process the model.dat file and the templates to create the module
 # (C++ and Python).
 #
+# The model bindings are split across NSHARDS files, as compiling a
+# single file containing all the models is slow and needs a lot of
+# memory. The file names come from get_shard_files in
+# helpers/template.py (there are none when NSHARDS is 1, as all the
+# models are then in xspec.cxx). The number of files can be changed
+# with the XSPEC_MODELS_CXC_NSHARDS environment variable.
+#
+NSHARDS = int(os.getenv("XSPEC_MODELS_CXC_NSHARDS", "4"))
+if NSHARDS < 1:
+    sys.stderr.write(f'ERROR: XSPEC_MODELS_CXC_NSHARDS must be >= 1, not {NSHARDS}\n')
+    sys.exit(1)
+
 compiled_code = out_dir / 'xspec.cxx'
 python_code = out_dir / '__init__.py'
+shard_code = template.get_shard_files(compiled_code, NSHARDS)
 
 helper("apply_templates.py", str(modeldat), xspec_version,
-       str(compiled_code), str(python_code))
+       str(compiled_code), str(python_code), str(NSHARDS))
+
+# Link-time optimization can be turned on by setting the
+# XSPEC_MODELS_CXC_LTO environment variable. It is not the default as
+# it increases the build time and has seen limited testing.
+#
+extra_args = []
+if os.getenv("XSPEC_MODELS_CXC_LTO") is not None:
+    print("** Using link-time optimization")
+    extra_args.append("-flto")
+
+# The header files used by the compiled code. The XSPEC headers are
+# included so that the module is re-built if XSPEC is updated.
+#
+header_files = [include_dir / 'xspec_models_cxc.hh'] + \
+    [xspec_inc_dir / name for name in ['xsTypes.h',
+                                       'XSFunctions/functionMap.h',
+                                       'XSFunctions/funcWrappers.h']]
+header_files = [str(h) for h in header_files if h.is_file()]
 
 ######################################################################
 #
@@ -151,20 +245,91 @@ helper("apply_templates.py", str(modeldat), xspec_version,
 #
 ext_modules = [
     Pybind11Extension("xspec_models_cxc._compiled",
-                      [str(compiled_code)],
-                      depends=[str('template/xspec.cxx')  # is this useful?
-                      ],
+                      [str(compiled_code)] + [str(s) for s in shard_code],
+                      depends=header_files,
                       cxx_std=11,
                       include_dirs=[str(include_dir),
                                     str(xspec_inc_dir)],
                       library_dirs=[str(xspec_lib_dir)],
                       libraries=xspec_libs,
-                      define_macros=macros
+                      define_macros=macros,
+                      extra_compile_args=extra_args,
+                      extra_link_args=extra_args
                   ),
 ]
 
+# Use ccache (or sccache) if it is available, since the generated
+# code rarely changes. It is only used to compile the code, and not
+# to link it. Set CCACHE_DISABLE to turn this off.
+#
+def get_launcher() -> str | None:
+    """Return the compiler cache to use, if any."""
+
+    if os.getenv("CCACHE_DISABLE") is not None:
+        return None
+
+    for name in ["ccache", "sccache"]:
+        launcher = shutil.which(name)
+        if launcher is not None:
+            return launcher
+
+    return None
+
+
+class BuildExt(build_ext):
+    """Compile the code with ccache or sccache, if available.
+
+    The object files are always written to the same location, rather
+    than a temporary directory (as happens with editable installs),
+    so they can be re-used by later builds.
+    """
+
+    def finalize_options(self) -> None:
+        super().finalize_options()
+        plat = f"{sysconfig.get_platform()}-{sys.implementation.cache_tag}"
+        self.build_temp = str(Path("build") / f"temp.{plat}")
+
+    def build_extensions(self) -> None:
+        launcher = get_launcher()
+        if launcher is not None and self.compiler.compiler_type == "unix":
+            # Newer setuptools versions use compiler_so_cxx for C++ code.
+            for attr in ["compiler_so", "compiler_so_cxx"]:
+                command = getattr(self.compiler, attr, None)
+                if command is None:
+                    continue
+
+                # Do not add the launcher if it is already being used
+                # (e.g. CXX="ccache g++").
+                if Path(command[0]).name in ["ccache", "sccache"]:
+                    continue
+
+                setattr(self.compiler, attr, [launcher] + command)
+
+            print(f"** Using compiler cache: {launcher}")
+
+        super().build_extensions()
+
+
+# Compile the files in parallel. The number of jobs can be set with
+# the NPY_NUM_BUILD_JOBS environment variable, otherwise it is the
+# number of CPUs.
+#
+# Files are only re-compiled when the object file is older than the
+# source file or any of the header files (the generated files are only
+# re-created when the inputs change, see helpers/apply_templates.py).
+# This only helps when the build directory is kept between builds.
+#
+def needs_recompile(obj: str, src: str) -> bool:
+    """Does the object file need to be re-created?"""
+
+    return any(naive_recompile(obj, name) for name in [src] + header_files)
+
+
+ParallelCompile("NPY_NUM_BUILD_JOBS",
+                needs_recompile=needs_recompile).install()
+
 setup(
     version=__version__,
     ext_modules=ext_modules,
-    cmdclass={"build_ext": build_ext},
+    cmdclass={"build_ext": BuildExt},
 )
@@ -7,8 +7,10 @@
 #ifndef __xspec_models_cxc_hh__
 #define __xspec_models_cxc_hh__
 
+#include <algorithm>
 #include <iostream>
 #include <fstream>
+#include <mutex>
 
 #include <pybind11/pybind11.h>
 #include <pybind11/stl.h>
@@ -29,7 +31,10 @@ namespace xspec_models_cxc {
 // Can we make this accessible to other users (e.g. for people who
 // want to bind to user models?).
 //
-void init() {
+// The routines in this file are inline since the header is included
+// by each of the files the models are compiled in.
+//
+inline void init() {
   static bool ran = false;
   if (ran) { return; }
 
@@ -62,6 +67,39 @@ void init() {
 }
 
 
+// XSPEC is not thread safe, so access to the library is serialized
+// with this mutex. The GIL is released while a model is evaluated, so
+// that other Python threads can run, which means that any other
+// routine that uses the library must also hold the mutex.
+//
+// When evaluating a model the GIL must be released before the mutex
+// is acquired, and the mutex released before the GIL is re-acquired,
+// so that a thread holding the GIL and waiting for the mutex can not
+// deadlock with the thread evaluating the model. That is
+//
+//   {
+//     py::gil_scoped_release release;
+//     std::lock_guard<std::mutex> lock(xspec_mutex());
+//     model(...);
+//   }
+//
+inline std::mutex &xspec_mutex() {
+  static std::mutex mutex;
+  return mutex;
+}
+
+
+// Use this when calling the library with the GIL held. The library is
+// initialized if needed.
+//
+class library_guard {
+  std::lock_guard<std::mutex> lock;
+
+public:
+  library_guard() : lock(xspec_mutex()) { init(); }
+};
+
+
 // The FORTRAN interface looks like
 //
 //   void agnsed_(float* ear, int* ne, float* param, int* ifl, float* photar, float* photer);
@@ -90,7 +128,7 @@ void init() {
 //
 
 // Check the number of parameters
-void validate_par_size(const int NumPars, const int got) {
+inline void validate_par_size(const int NumPars, const int got) {
   if (NumPars == got)
     return;
 
@@ -100,7 +138,7 @@ void validate_par_size(const int NumPars, const int got) {
 }
 
 // Provide a useful error message if the sizes don't match
-void validate_grid_size(const int energySize, const int modelSize) {
+inline void validate_grid_size(const int energySize, const int modelSize) {
 
   if (energySize == modelSize + 1)
     return;
@@ -133,7 +171,11 @@ RealArray& wrapper_inplace_CXX(const RealArray pars,
   auto errors = RealArray(output.size());
 
   xspec_models_cxc::init();
-  model(energyArray, pars, spectrumNumber, output, errors, initStr.c_str());
+  {
+    py::gil_scoped_release release;
+    std::lock_guard<std::mutex> lock(xspec_mutex());
+    model(energyArray, pars, spectrumNumber, output, errors, initStr.c_str());
+  }
   return output;
 }
 
@@ -169,7 +211,11 @@ py::array_t<Real> wrapper_C(py::array_t<Real, py::array::c_style | py::array::fo
   double *optr = static_cast<Real *>(obuf.ptr);
 
   xspec_models_cxc::init();
-  model(eptr, nelem, pptr, spectrumNumber, optr, errors.data(), initStr.c_str());
+  {
+    py::gil_scoped_release release;
+    std::lock_guard<std::mutex> lock(xspec_mutex());
+    model(eptr, nelem, pptr, spectrumNumber, optr, errors.data(), initStr.c_str());
+  }
   return result;
 }
 
@@ -209,7 +255,11 @@ py::array_t<Real> wrapper_inplace_C(py::array_t<Real, py::array::c_style | py::a
   double *optr = static_cast<Real *>(obuf.ptr);
 
   xspec_models_cxc::init();
-  model(eptr, nelem, pptr, spectrumNumber, optr, errors.data(), initStr.c_str());
+  {
+    py::gil_scoped_release release;
+    std::lock_guard<std::mutex> lock(xspec_mutex());
+    model(eptr, nelem, pptr, spectrumNumber, optr, errors.data(), initStr.c_str());
+  }
   return output;
 }
 
@@ -248,7 +298,11 @@ py::array_t<float> wrapper_f(py::array_t<float, py::array::c_style | py::array::
   float *optr = static_cast<float *>(obuf.ptr);
 
   xspec_models_cxc::init();
-  model(eptr, nelem, pptr, spectrumNumber, optr, errors.data());
+  {
+    py::gil_scoped_release release;
+    std::lock_guard<std::mutex> lock(xspec_mutex());
+    model(eptr, nelem, pptr, spectrumNumber, optr, errors.data());
+  }
   return result;
 }
 
@@ -284,7 +338,11 @@ py::array_t<float> wrapper_inplace_f(py::array_t<float, py::array::c_style | py:
   float *optr = static_cast<float *>(obuf.ptr);
 
   xspec_models_cxc::init();
-  model(eptr, nelem, pptr, spectrumNumber, optr, errors.data());
+  {
+    py::gil_scoped_release release;
+    std::lock_guard<std::mutex> lock(xspec_mutex());
+    model(eptr, nelem, pptr, spectrumNumber, optr, errors.data());
+  }
   return output;
 }
 
@@ -319,7 +377,11 @@ py::array_t<double> wrapper_F(py::array_t<double, py::array::c_style | py::array
   double *optr = static_cast<double *>(obuf.ptr);
 
   xspec_models_cxc::init();
-  model(eptr, nelem, pptr, spectrumNumber, optr, errors.data());
+  {
+    py::gil_scoped_release release;
+    std::lock_guard<std::mutex> lock(xspec_mutex());
+    model(eptr, nelem, pptr, spectrumNumber, optr, errors.data());
+  }
   return result;
 }
 
@@ -355,20 +417,279 @@ py::array_t<double> wrapper_inplace_F(py::array_t<double, py::array::c_style | p
   double *optr = static_cast<double *>(obuf.ptr);
 
   xspec_models_cxc::init();
-  model(eptr, nelem, pptr, spectrumNumber, optr, errors.data());
+  {
+    py::gil_scoped_release release;
+    std::lock_guard<std::mutex> lock(xspec_mutex());
+    model(eptr, nelem, pptr, spectrumNumber, optr, errors.data());
+  }
+  return output;
+}
+
+
+// The convolution models change the model argument, so it must
+// already be a writeable, C-contiguous, array of the correct type. If
+// pybind11 were allowed to convert it then the result would be written
+// to a temporary copy and the input left unchanged. The same is true
+// of the out argument of the batch and convolution models.
+//
+template <typename T>
+py::array_t<T> require_inplace_array(const py::object &arr, const char *name) {
+  if (!py::isinstance<py::array_t<T, py::array::c_style>>(arr)) {
+    std::ostringstream err;
+    err << name << " must be a C-contiguous array of type "
+	<< py::str(py::dtype::of<T>()).cast<std::string>();
+    throw pybind11::type_error(err.str());
+  }
+
+  auto out = py::reinterpret_borrow<py::array_t<T>>(arr);
+  if (!out.writeable()) {
+    std::ostringstream err;
+    err << name << " must be writeable";
+    throw pybind11::value_error(err.str());
+  }
+
+  return out;
+}
+
+
+// Evaluate the model for a set of parameter values, where pars is a
+// 2D array with shape (nbatch, NumPars). The return value has shape
+// (nbatch, nbins) so that row i contains the model evaluated with
+// row i of pars. This avoids the per-call overhead of calling the
+// model from Python nbatch times. The inplace versions write to the
+// output array, which must have this shape, rather than creating it.
+//
+inline void validate_batch_pars(const int NumPars, const py::buffer_info &pbuf) {
+  if (pbuf.ndim != 2)
+    throw pybind11::value_error("pars must be 2D");
+
+  validate_par_size(NumPars, pbuf.shape[1]);
+}
+
+inline void validate_batch_output(const py::buffer_info &pbuf,
+				  const py::buffer_info &ebuf,
+				  const py::buffer_info &obuf) {
+  if (obuf.ndim != 2)
+    throw pybind11::value_error("out must be 2D");
+
+  if (obuf.shape[0] != pbuf.shape[0]) {
+    std::ostringstream err;
+    err << "Expected out to have " << pbuf.shape[0] << " rows but sent "
+	<< obuf.shape[0];
+    throw pybind11::value_error(err.str());
+  }
+
+  validate_grid_size(ebuf.size, obuf.shape[1]);
+}
+
+
+template <xsccCall model, int NumPars>
+py::array_t<Real> wrapper_batch_inplace_C(py::array_t<Real, py::array::c_style | py::array::forcecast> pars,
+					  py::array_t<Real, py::array::c_style | py::array::forcecast> energyArray,
+					  const py::object &outArg,
+					  const int spectrumNumber,
+					  const string initStr) {
+
+  auto output = require_inplace_array<Real>(outArg, "out");
+
+  py::buffer_info pbuf = pars.request(),
+    ebuf = energyArray.request(),
+    obuf = output.request();
+  if (ebuf.ndim != 1)
+    throw pybind11::value_error("energyArray must be 1D");
+
+  validate_batch_pars(NumPars, pbuf);
+
+  if (ebuf.size < 3)
+    throw pybind11::value_error("Expected at least 3 bin edges");
+
+  validate_batch_output(pbuf, ebuf, obuf);
+
+  // Should we force spectrumNumber >= 1?
+  // We shouldn't be able to send in an invalid initStr so do not bother checking.
+
+  const int nelem = ebuf.size - 1;
+  const py::ssize_t nbatch = pbuf.shape[0];
+
+  auto errors = std::vector<Real>(nelem);
+
+  Real *pptr = static_cast<Real *>(pbuf.ptr);
+  Real *eptr = static_cast<Real *>(ebuf.ptr);
+  Real *optr = static_cast<Real *>(obuf.ptr);
+
+  xspec_models_cxc::init();
+  {
+    py::gil_scoped_release release;
+    std::lock_guard<std::mutex> lock(xspec_mutex());
+    for (py::ssize_t i = 0; i < nbatch; i++) {
+      model(eptr, nelem, pptr + i * NumPars, spectrumNumber,
+	    optr + i * nelem, errors.data(), initStr.c_str());
+    }
+  }
+  return output;
+}
+
+
+template <xsccCall model, int NumPars>
+py::array_t<Real> wrapper_batch_C(py::array_t<Real, py::array::c_style | py::array::forcecast> pars,
+				  py::array_t<Real, py::array::c_style | py::array::forcecast> energyArray,
+				  const int spectrumNumber,
+				  const string initStr) {
+
+  py::buffer_info pbuf = pars.request(), ebuf = energyArray.request();
+  if (ebuf.ndim != 1)
+    throw pybind11::value_error("energyArray must be 1D");
+
+  validate_batch_pars(NumPars, pbuf);
+
+  if (ebuf.size < 3)
+    throw pybind11::value_error("Expected at least 3 bin edges");
+
+  const py::ssize_t nelem = ebuf.size - 1;
+  auto result = py::array_t<Real>(std::vector<py::ssize_t>{pbuf.shape[0], nelem});
+  return wrapper_batch_inplace_C<model, NumPars>(pars, energyArray, result,
+						 spectrumNumber, initStr);
+}
+
+
+template <xsf77Call model, int NumPars>
+py::array_t<float> wrapper_batch_inplace_f(py::array_t<float, py::array::c_style | py::array::forcecast> pars,
+					   py::array_t<float, py::array::c_style | py::array::forcecast> energyArray,
+					   const py::object &outArg,
+					   const int spectrumNumber) {
+
+  auto output = require_inplace_array<float>(outArg, "out");
+
+  py::buffer_info pbuf = pars.request(),
+    ebuf = energyArray.request(),
+    obuf = output.request();
+  if (ebuf.ndim != 1)
+    throw pybind11::value_error("energyArray must be 1D");
+
+  validate_batch_pars(NumPars, pbuf);
+
+  if (ebuf.size < 3)
+    throw pybind11::value_error("Expected at least 3 bin edges");
+
+  validate_batch_output(pbuf, ebuf, obuf);
+
+  const int nelem = ebuf.size - 1;
+  const py::ssize_t nbatch = pbuf.shape[0];
+
+  auto errors = std::vector<float>(nelem);
+
+  float *pptr = static_cast<float *>(pbuf.ptr);
+  float *eptr = static_cast<float *>(ebuf.ptr);
+  float *optr = static_cast<float *>(obuf.ptr);
+
+  xspec_models_cxc::init();
+  {
+    py::gil_scoped_release release;
+    std::lock_guard<std::mutex> lock(xspec_mutex());
+    for (py::ssize_t i = 0; i < nbatch; i++) {
+      model(eptr, nelem, pptr + i * NumPars, spectrumNumber,
+	    optr + i * nelem, errors.data());
+    }
+  }
+  return output;
+}
+
+
+template <xsf77Call model, int NumPars>
+py::array_t<float> wrapper_batch_f(py::array_t<float, py::array::c_style | py::array::forcecast> pars,
+				   py::array_t<float, py::array::c_style | py::array::forcecast> energyArray,
+				   const int spectrumNumber) {
+
+  py::buffer_info pbuf = pars.request(), ebuf = energyArray.request();
+  if (ebuf.ndim != 1)
+    throw pybind11::value_error("energyArray must be 1D");
+
+  validate_batch_pars(NumPars, pbuf);
+
+  if (ebuf.size < 3)
+    throw pybind11::value_error("Expected at least 3 bin edges");
+
+  const py::ssize_t nelem = ebuf.size - 1;
+  auto result = py::array_t<float>(std::vector<py::ssize_t>{pbuf.shape[0], nelem});
+  return wrapper_batch_inplace_f<model, NumPars>(pars, energyArray, result,
+						 spectrumNumber);
+}
+
+
+template <xsF77Call model, int NumPars>
+py::array_t<double> wrapper_batch_inplace_F(py::array_t<double, py::array::c_style | py::array::forcecast> pars,
+					    py::array_t<double, py::array::c_style | py::array::forcecast> energyArray,
+					    const py::object &outArg,
+					    const int spectrumNumber) {
+
+  auto output = require_inplace_array<double>(outArg, "out");
+
+  py::buffer_info pbuf = pars.request(),
+    ebuf = energyArray.request(),
+    obuf = output.request();
+  if (ebuf.ndim != 1)
+    throw pybind11::value_error("energyArray must be 1D");
+
+  validate_batch_pars(NumPars, pbuf);
+
+  if (ebuf.size < 3)
+    throw pybind11::value_error("Expected at least 3 bin edges");
+
+  validate_batch_output(pbuf, ebuf, obuf);
+
+  const int nelem = ebuf.size - 1;
+  const py::ssize_t nbatch = pbuf.shape[0];
+
+  auto errors = std::vector<double>(nelem);
+
+  double *pptr = static_cast<double *>(pbuf.ptr);
+  double *eptr = static_cast<double *>(ebuf.ptr);
+  double *optr = static_cast<double *>(obuf.ptr);
+
+  xspec_models_cxc::init();
+  {
+    py::gil_scoped_release release;
+    std::lock_guard<std::mutex> lock(xspec_mutex());
+    for (py::ssize_t i = 0; i < nbatch; i++) {
+      model(eptr, nelem, pptr + i * NumPars, spectrumNumber,
+	    optr + i * nelem, errors.data());
+    }
+  }
   return output;
 }
 
 
+template <xsF77Call model, int NumPars>
+py::array_t<double> wrapper_batch_F(py::array_t<double, py::array::c_style | py::array::forcecast> pars,
+				    py::array_t<double, py::array::c_style | py::array::forcecast> energyArray,
+				    const int spectrumNumber) {
+
+  py::buffer_info pbuf = pars.request(), ebuf = energyArray.request();
+  if (ebuf.ndim != 1)
+    throw pybind11::value_error("energyArray must be 1D");
+
+  validate_batch_pars(NumPars, pbuf);
+
+  if (ebuf.size < 3)
+    throw pybind11::value_error("Expected at least 3 bin edges");
+
+  const py::ssize_t nelem = ebuf.size - 1;
+  auto result = py::array_t<double>(std::vector<py::ssize_t>{pbuf.shape[0], nelem});
+  return wrapper_batch_inplace_F<model, NumPars>(pars, energyArray, result,
+						 spectrumNumber);
+}
+
+
 // I believe this shoud be marked py::return_value_policy::reference
 //
 template <xsccCall model, int NumPars>
 py::array_t<Real> wrapper_con_C(py::array_t<Real, py::array::c_style | py::array::forcecast> pars,
 				py::array_t<Real, py::array::c_style | py::array::forcecast> energyArray,
-				py::array_t<Real, py::array::c_style | py::array::forcecast> inModel,
+				const py::object &modelArg,
 				const int spectrumNumber,
 				const string initStr) {
 
+  auto inModel = require_inplace_array<Real>(modelArg, "model");
   py::buffer_info pbuf = pars.request(),
     ebuf = energyArray.request(),
     mbuf = inModel.request();
@@ -395,7 +716,11 @@ py::array_t<Real> wrapper_con_C(py::array_t<Real, py::array::c_style | py::array
   double *mptr = static_cast<Real *>(mbuf.ptr);
 
   xspec_models_cxc::init();
-  model(eptr, nelem, pptr, spectrumNumber, mptr, errors.data(), initStr.c_str());
+  {
+    py::gil_scoped_release release;
+    std::lock_guard<std::mutex> lock(xspec_mutex());
+    model(eptr, nelem, pptr, spectrumNumber, mptr, errors.data(), initStr.c_str());
+  }
   return inModel;
 }
 
@@ -405,9 +730,10 @@ py::array_t<Real> wrapper_con_C(py::array_t<Real, py::array::c_style | py::array
 template <xsf77Call model, int NumPars>
 py::array_t<float> wrapper_con_f(py::array_t<float, py::array::c_style | py::array::forcecast> pars,
 				 py::array_t<float, py::array::c_style | py::array::forcecast> energyArray,
-				 py::array_t<float, py::array::c_style | py::array::forcecast> inModel,
+				 const py::object &modelArg,
 				 const int spectrumNumber) {
 
+  auto inModel = require_inplace_array<float>(modelArg, "model");
   py::buffer_info pbuf = pars.request(),
     ebuf = energyArray.request(),
     mbuf = inModel.request();
@@ -434,10 +760,113 @@ py::array_t<float> wrapper_con_f(py::array_t<float, py::array::c_style | py::arr
   float *mptr = static_cast<float *>(mbuf.ptr);
 
   xspec_models_cxc::init();
-  model(eptr, nelem, pptr, spectrumNumber, mptr, errors.data());
+  {
+    py::gil_scoped_release release;
+    std::lock_guard<std::mutex> lock(xspec_mutex());
+    model(eptr, nelem, pptr, spectrumNumber, mptr, errors.data());
+  }
   return inModel;
 }
 
+// The convolution models over-write the input model. These versions
+// leave the model argument unchanged and write the result to output
+// instead, which avoids having to copy the model in Python.
+//
+template <xsccCall model, int NumPars>
+py::array_t<Real> wrapper_con_out_C(py::array_t<Real, py::array::c_style | py::array::forcecast> pars,
+				    py::array_t<Real, py::array::c_style | py::array::forcecast> energyArray,
+				    py::array_t<Real, py::array::c_style | py::array::forcecast> inModel,
+				    const py::object &outArg,
+				    const int spectrumNumber,
+				    const string initStr) {
+
+  auto output = require_inplace_array<Real>(outArg, "out");
+  py::buffer_info pbuf = pars.request(),
+    ebuf = energyArray.request(),
+    mbuf = inModel.request(),
+    obuf = output.request();
+  if (pbuf.ndim != 1 || ebuf.ndim != 1 || mbuf.ndim != 1 || obuf.ndim != 1)
+    throw pybind11::value_error("pars, energyArray, model, and out must be 1D");
+
+  validate_par_size(NumPars, pbuf.size);
+
+  if (ebuf.size < 3)
+    throw pybind11::value_error("Expected at least 3 bin edges");
+
+  validate_grid_size(ebuf.size, mbuf.size);
+  validate_grid_size(ebuf.size, obuf.size);
+
+  // Should we force spectrumNumber >= 1?
+  // We shouldn't be able to send in an invalid initStr so do not bother checking.
+
+  const int nelem = ebuf.size - 1;
+
+  // Can we easily zero out the arrays?
+  auto errors = std::vector<Real>(nelem);
+
+  double *pptr = static_cast<Real *>(pbuf.ptr);
+  double *eptr = static_cast<Real *>(ebuf.ptr);
+  double *mptr = static_cast<Real *>(mbuf.ptr);
+  double *optr = static_cast<Real *>(obuf.ptr);
+
+  if (optr != mptr)
+    std::copy(mptr, mptr + nelem, optr);
+
+  xspec_models_cxc::init();
+  {
+    py::gil_scoped_release release;
+    std::lock_guard<std::mutex> lock(xspec_mutex());
+    model(eptr, nelem, pptr, spectrumNumber, optr, errors.data(), initStr.c_str());
+  }
+  return output;
+}
+
+
+template <xsf77Call model, int NumPars>
+py::array_t<float> wrapper_con_out_f(py::array_t<float, py::array::c_style | py::array::forcecast> pars,
+				     py::array_t<float, py::array::c_style | py::array::forcecast> energyArray,
+				     py::array_t<float, py::array::c_style | py::array::forcecast> inModel,
+				     const py::object &outArg,
+				     const int spectrumNumber) {
+
+  auto output = require_inplace_array<float>(outArg, "out");
+  py::buffer_info pbuf = pars.request(),
+    ebuf = energyArray.request(),
+    mbuf = inModel.request(),
+    obuf = output.request();
+  if (pbuf.ndim != 1 || ebuf.ndim != 1 || mbuf.ndim != 1 || obuf.ndim != 1)
+    throw pybind11::value_error("pars, energyArray, model, and out must be 1D");
+
+  validate_par_size(NumPars, pbuf.size);
+
+  if (ebuf.size < 3)
+    throw pybind11::value_error("Expected at least 3 bin edges");
+
+  validate_grid_size(ebuf.size, mbuf.size);
+  validate_grid_size(ebuf.size, obuf.size);
+
+  const int nelem = ebuf.size - 1;
+
+  // Can we easily zero out the arrays?
+  auto errors = std::vector<float>(nelem);
+
+  float *pptr = static_cast<float *>(pbuf.ptr);
+  float *eptr = static_cast<float *>(ebuf.ptr);
+  float *mptr = static_cast<float *>(mbuf.ptr);
+  float *optr = static_cast<float *>(obuf.ptr);
+
+  if (optr != mptr)
+    std::copy(mptr, mptr + nelem, optr);
+
+  xspec_models_cxc::init();
+  {
+    py::gil_scoped_release release;
+    std::lock_guard<std::mutex> lock(xspec_mutex());
+    model(eptr, nelem, pptr, spectrumNumber, optr, errors.data());
+  }
+  return output;
+}
+
 } // namespace: xspec_models_cxc
 
 #endif
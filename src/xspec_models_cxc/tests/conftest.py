@@ -0,0 +1,27 @@
+# Copyright (C) 2024
+# Smithsonian Astrophysical Observatory
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+# Common set up for the tests.
+#
+
+import pytest
+
+import xspec_models_cxc as x
+
+
+@pytest.fixture(scope="session", autouse=True)
+def xspec_setup():
+    """Set up the XSPEC model library for the tests.
+
+    We need to set up the cosmology as this is currently not done in
+    FNINIT. We also want to ensure we have a fixed abundance / cross
+    section for the checks, otherwise they would depend on the user's
+    ~/.xspec/Xspec.init file.
+    """
+
+    x.cosmology(h0=70, lambda0=0.73, q0=0)
+    x.abundance('lodd')
+    x.cross_section('vern')
+    yield
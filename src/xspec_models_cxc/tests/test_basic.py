@@ -6,6 +6,9 @@
 # Basic tests of the module
 #
 
+import dataclasses
+import itertools
+
 import numpy as np
 
 import pytest
@@ -13,18 +16,6 @@ import pytest
 import xspec_models_cxc as x
 
 
-# We need to set up the cosmology as this is currently not done in FNINIT.
-#
-x.cosmology(h0=70, lambda0=0.73, q0=0)
-
-# We want to ensure we have a fixed abundance / cross section
-# for the checks below. If we didn't set them here then it
-# would depend on the user's ~/.xspec/Xspec.init file
-#
-x.abundance('lodd')
-x.cross_section('vern')
-
-
 def get_dtype(model):
     """What is the drtype used by this model?"""
 
@@ -34,6 +25,56 @@ def get_dtype(model):
             x.LanguageStyle.F77Style8: np.float64}[model.language]
 
 
+def get_pars(model, **overrides):
+    """The parameter values to use for the model.
+
+    The defaults are used unless the parameter name (case insensitive)
+    is given in overrides. The values use the dtype of the model.
+    """
+
+    pars = [overrides.get(p.name.casefold(), p.default)
+            for p in model.parameters]
+    return np.asarray(pars, dtype=get_dtype(model))
+
+
+# The energy grid used to evaluate the models. The single-precision
+# version is used for the models that need it, to avoid converting the
+# grid on each call.
+#
+EGRID = np.linspace(0.1, 9.99, 990)
+EGRID32 = EGRID.astype(np.float32)
+
+
+def get_egrid(model):
+    """The energy grid to use for the model."""
+
+    return EGRID32 if get_dtype(model) == np.float32 else EGRID
+
+
+@pytest.fixture(scope="module")
+def out_buffer():
+    """Return an output array for a model, matching EGRID.
+
+    The arrays are re-used between tests, one per dtype, and are
+    filled with the given value before being returned.
+    """
+
+    buffers = {}
+
+    def get(model, value):
+        dtype = get_dtype(model)
+        try:
+            out = buffers[dtype]
+        except KeyError:
+            out = np.empty(EGRID.size - 1, dtype=dtype)
+            buffers[dtype] = out
+
+        out.fill(value)
+        return out
+
+    return get
+
+
 def test_have_version():
     """Minimal chekc of get_versino"""
     v = x.get_version()
@@ -73,7 +114,7 @@ def test_elementAbundance(z, value):
 
 
 def test_cosmo_get():
-    """Check the values we set above"""
+    """Check the values set by the xspec_setup fixture in conftest.py"""
     ans = x.cosmology()
     assert ans == pytest.approx({'h0': 70, 'lambda0': 0.73, 'q0': 0.0})
 
@@ -107,13 +148,48 @@ def test_has_wabs_info():
     assert not par.frozen
 
 
+def test_info_can_not_be_changed():
+    """The model information is read only."""
+
+    model = x.info('apec')
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        model.name = 'not-apec'
+
+    par = model.parameters[0]
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        par.default = 2.0
+
+    assert isinstance(model.parameters, tuple)
+    with pytest.raises(TypeError):
+        model.parameters[0] = par
+
+    with pytest.raises(AttributeError):
+        model.parameters.append(par)
+
+
+def test_info_can_be_hashed():
+    """The model information can be used as a dictionary key."""
+
+    model = x.info('apec')
+    assert hash(model) == hash(x.info('APEC'))
+    assert hash(model.parameters[0]) == hash(x.info('apec').parameters[0])
+    assert {model: 1}[x.info('apec')] == 1
+
+
 WABS_MODEL = [8.8266723e-05, 2.3582002e-02, 1.5197776e-01]
+WABS_APPROX = pytest.approx(WABS_MODEL)
+
+# The different ways the wabs parameters and energy grid can be sent
+# in. The model is the same in each case, so the combinations are
+# checked within a single test rather than via parametrize.
+#
+WABS_PARS = [[0.1], (0.1, ), np.asarray([0.1])]
+WABS_ENERGIES = [[0.1, 0.2, 0.3, 0.4],
+                 (0.1, 0.2, 0.3, 0.4),
+                 np.linspace(0.1, 0.4, 4)]
+
 
-@pytest.mark.parametrize("pars", [[0.1], (0.1, ), np.asarray([0.1])])
-@pytest.mark.parametrize("energies", [[0.1, 0.2, 0.3, 0.4],
-                                      (0.1, 0.2, 0.3, 0.4),
-                                      np.arange(0.1, 0.5, 0.1)])
-def test_eval_wabs(pars, energies):
+def test_eval_wabs():
     """Explicit tests of a model.
 
     This checks a "random" model - chosen as wabs as it's assumed it's
@@ -121,28 +197,80 @@ def test_eval_wabs(pars, energies):
 
     """
 
-    y = x.wabs(energies=energies, pars=pars)
+    for pars, energies in itertools.product(WABS_PARS, WABS_ENERGIES):
+        y = x.wabs(energies=energies, pars=pars)
 
-    # Let's assume this isn't going to change much
-    #
-    assert y == pytest.approx(WABS_MODEL)
+        # Let's assume this isn't going to change much
+        #
+        assert y == WABS_APPROX, (pars, energies)
 
 
-@pytest.mark.parametrize("pars", [[0.1], (0.1, ), np.asarray([0.1])])
-@pytest.mark.parametrize("energies", [[0.1, 0.2, 0.3, 0.4],
-                                      (0.1, 0.2, 0.3, 0.4),
-                                      np.arange(0.1, 0.5, 0.1)])
-def test_eval_wabs_inline(pars, energies):
+def test_eval_wabs_inline():
     """See test_eval_wabs"""
 
-    out = np.ones(3, dtype=np.float32)
-    y = x.wabs(energies=energies, pars=pars, out=out)
+    for pars, energies in itertools.product(WABS_PARS, WABS_ENERGIES):
+        out = np.ones(3, dtype=np.float32)
+        y = x.wabs(energies=energies, pars=pars, out=out)
 
-    # Let's assume this isn't going to change much
-    #
-    assert y == pytest.approx(WABS_MODEL)
+        # Let's assume this isn't going to change much
+        #
+        assert y == WABS_APPROX, (pars, energies)
+
+        assert y is out
+
+
+def test_eval_wabs_batch():
+    """See test_eval_wabs"""
+
+    pars = [[0.1], [0.1], [0.2]]
+    egrid = [0.1, 0.2, 0.3, 0.4]
+    y = x.wabs_batch(energies=egrid, pars=pars)
+
+    assert y.shape == (3, 3)
+    assert y[0] == WABS_APPROX
+    assert y[1] == WABS_APPROX
+    assert y[2] == pytest.approx(x.wabs(energies=egrid, pars=pars[2]))
+
+
+def test_eval_wabs_batch_inplace():
+    """See test_eval_wabs_batch"""
+
+    pars = [[0.1], [0.2]]
+    egrid = [0.1, 0.2, 0.3, 0.4]
+    out = np.zeros((2, 3), dtype=np.float32)
+    y = x.wabs_batch(energies=egrid, pars=pars, out=out)
 
     assert y is out
+    assert y[0] == WABS_APPROX
+    assert y[1] == pytest.approx(x.wabs(energies=egrid, pars=pars[1]))
+
+
+def test_eval_wabs_batch_inplace_wrong_shape():
+    """The out array must match the parameters and grid."""
+
+    out = np.zeros((3, 3), dtype=np.float32)
+    with pytest.raises(ValueError, match="^Expected out to have 2 rows but sent 3$"):
+        x.wabs_batch(energies=[0.1, 0.2, 0.3, 0.4], pars=[[0.1], [0.2]], out=out)
+
+
+def test_eval_wabs_batch_inplace_wrong_type():
+    """The out array is not converted to the model type."""
+
+    out = np.zeros((2, 3), dtype=np.float64)
+    with pytest.raises(TypeError,
+                       match="^out must be a C-contiguous array of type float32$"):
+        x.wabs_batch(energies=[0.1, 0.2, 0.3, 0.4], pars=[[0.1], [0.2]], out=out)
+
+    assert out == pytest.approx(np.zeros((2, 3)))
+
+
+def test_eval_wabs_batch_inplace_not_writeable():
+    """The out array must be writeable."""
+
+    out = np.zeros((2, 3), dtype=np.float32)
+    out.flags.writeable = False
+    with pytest.raises(ValueError, match="^out must be writeable$"):
+        x.wabs_batch(energies=[0.1, 0.2, 0.3, 0.4], pars=[[0.1], [0.2]], out=out)
 
 
 # Unfortunately some models need to be skipped for some reason. This
@@ -164,24 +292,24 @@ MODELS_ADD = x.list_models(modeltype=x.ModelType.Add)
 MODELS_MUL = x.list_models(modeltype=x.ModelType.Mul)
 MODELS_CON = x.list_models(modeltype=x.ModelType.Con)
 
-MODELS_ADD_SKIP = ['grbjet']
-MODELS_MUL_SKIP = []
-MODELS_CON_SKIP = ['rfxconv', 'rgsxsrc', 'xilconv']
+MODELS_ADD_SKIP = {'grbjet'}
+MODELS_MUL_SKIP = set()
+MODELS_CON_SKIP = {'rfxconv', 'rgsxsrc', 'xilconv'}
 
 if x.get_version() in ["12.14.0", "12.14.0a", "12.14.0b",
                        "12.14.0c", "21.14.0d", "12.14.0e"]:
-    MODELS_ADD_SKIP.append("bsedov")
+    MODELS_ADD_SKIP.add("bsedov")
 
 if x.get_version() in ["12.14.0", "12.14.0a", "12.14.0b",
                        "12.14.0c", "21.14.0d", "12.14.0e",
                        "12.14.0f", "12.14.0g", "12.14.0h"]:
-    MODELS_ADD_SKIP.append("bvvnei")
+    MODELS_ADD_SKIP.add("bvvnei")
 
 # XSPEC 12.14.1 and 12.14.1a fail, but it's not obvious that patch a
 # was ever released as patch b was released at the same time.
 #
 if x.get_version() == "12.14.1":
-    MODELS_MUL_SKIP.append("ismabs")
+    MODELS_MUL_SKIP.add("ismabs")
 
 
 @pytest.mark.parametrize("model", MODELS_ADD)
@@ -203,18 +331,14 @@ def test_eval_add(model):
         pytest.skip(f"Model {model} is marked as un-testable.")
 
     mfunc = getattr(x, model)
-
-    pars = [0.1 if p.name.casefold() == 'redshift' else p.default
-            for p in info.parameters]
-
-    egrid = np.arange(0.1, 10, 0.01)
-    y1 = mfunc(energies=egrid, pars=pars)
+    pars = get_pars(info, redshift=0.1)
+    y1 = mfunc(energies=get_egrid(info), pars=pars)
 
     assert (y1 > 0).any()
 
 
 @pytest.mark.parametrize("model", MODELS_ADD)
-def test_eval_add_inline(model):
+def test_eval_add_inline(model, out_buffer):
     """Evaluate an additive model using the inline mode.
 
     See test_eval_add
@@ -228,13 +352,9 @@ def test_eval_add_inline(model):
         pytest.skip(f"Model {model} is marked as un-testable.")
 
     mfunc = getattr(x, model)
-
-    pars = [0.1 if p.name.casefold() == 'redshift' else p.default
-            for p in info.parameters]
-
-    egrid = np.arange(0.1, 10, 0.01)
-    out = np.zeros(egrid.size - 1, dtype=get_dtype(info))
-    y1 = mfunc(energies=egrid, pars=pars, out=out)
+    pars = get_pars(info, redshift=0.1)
+    out = out_buffer(info, 0)
+    y1 = mfunc(energies=get_egrid(info), pars=pars, out=out)
 
     assert (y1 > 0).any()
     assert y1 is out
@@ -251,17 +371,14 @@ def test_eval_mul(model):
         pytest.skip(f"Model {model} is marked as un-testable.")
 
     mfunc = getattr(x, model)
-
-    pars = [p.default for p in info.parameters]
-
-    egrid = np.arange(0.1, 10, 0.01)
-    y1 = mfunc(energies=egrid, pars=pars)
+    pars = get_pars(info)
+    y1 = mfunc(energies=get_egrid(info), pars=pars)
 
     assert (y1 > 0).any()
 
 
 @pytest.mark.parametrize("model", MODELS_MUL)
-def test_eval_mul_inline(model):
+def test_eval_mul_inline(model, out_buffer):
     """Evaluate a multiplicative model (inline).
     """
 
@@ -271,12 +388,9 @@ def test_eval_mul_inline(model):
         pytest.skip(f"Model {model} is marked as un-testable.")
 
     mfunc = getattr(x, model)
-
-    pars = [p.default for p in info.parameters]
-
-    egrid = np.arange(0.1, 10, 0.01)
-    out = np.ones(egrid.size - 1, dtype=get_dtype(info))
-    y1 = mfunc(energies=egrid, pars=pars, out=out)
+    pars = get_pars(info)
+    out = out_buffer(info, 1)
+    y1 = mfunc(energies=get_egrid(info), pars=pars, out=out)
 
     assert (y1 > 0).any()
     assert y1 is out
@@ -296,30 +410,75 @@ def test_eval_con_inline(model):
     if model in MODELS_CON_SKIP:
         pytest.skip(f"Model {model} is marked as un-testable.")
 
-    egrid = np.arange(0.1, 10, 0.01)
+    pars = get_pars(x.info('powerlaw'))
+    mvals = x.powerlaw(energies=EGRID, pars=pars)
+    mvals = mvals.astype(get_dtype(info))
+    ymodel = mvals.copy()
 
-    def conv(p):
-        """what is the default parameter value?"""
+    mfunc = getattr(x, model)
 
-        if p.name.casefold() == 'redshift':
-            return 0.01
+    pars = get_pars(info, redshift=0.01, velocity=100)
+    y1 = mfunc(energies=get_egrid(info), pars=pars, model=mvals)
 
-        if p.name.casefold() == 'velocity':
-            return 100
+    assert (y1 > 0).any()
+    assert (y1 != ymodel).any()
 
-        return p.default
+    assert y1 is mvals
+
+
+@pytest.mark.parametrize("model", MODELS_CON)
+def test_eval_con_out(model, out_buffer):
+    """Evaluate a convolution model with the out argument.
+
+    See test_eval_con_inline
+    """
 
-    pars = [p.default for p in x.info('powerlaw').parameters]
-    mvals = x.powerlaw(energies=egrid, pars=pars)
+    info = x.info(model)
+    if not info.can_cache:
+        pytest.skip(f"Model {model} can not be cached.")
+
+    if model in MODELS_CON_SKIP:
+        pytest.skip(f"Model {model} is marked as un-testable.")
+
+    pars = get_pars(x.info('powerlaw'))
+    mvals = x.powerlaw(energies=EGRID, pars=pars)
     mvals = mvals.astype(get_dtype(info))
     ymodel = mvals.copy()
+    out = out_buffer(info, 0)
 
     mfunc = getattr(x, model)
 
-    pars = [conv(p) for p in info.parameters]
-    y1 = mfunc(energies=egrid, pars=pars, model=mvals)
+    pars = get_pars(info, redshift=0.01, velocity=100)
+    y1 = mfunc(energies=get_egrid(info), pars=pars, model=mvals, out=out)
 
     assert (y1 > 0).any()
     assert (y1 != ymodel).any()
 
-    assert y1 is mvals
+    assert y1 is out
+    assert mvals == pytest.approx(ymodel)
+
+
+@pytest.mark.parametrize("mvals",
+                         [np.ones(EGRID.size - 1, dtype=np.float32),
+                          list(np.ones(EGRID.size - 1)),
+                          np.ones(2 * (EGRID.size - 1))[::2]])
+def test_eval_con_model_not_converted(mvals):
+    """The model argument must have the correct type as it is changed.
+
+    gsmooth is used as it is a float64 model.
+    """
+
+    pars = get_pars(x.info('gsmooth'))
+    with pytest.raises(TypeError,
+                       match="^model must be a C-contiguous array of type float64$"):
+        x.gsmooth(energies=EGRID, pars=pars, model=mvals)
+
+
+def test_eval_con_model_not_writeable():
+    """The model argument is changed so it must be writeable."""
+
+    pars = get_pars(x.info('gsmooth'))
+    mvals = np.ones(EGRID.size - 1)
+    mvals.flags.writeable = False
+    with pytest.raises(ValueError, match="^model must be writeable$"):
+        x.gsmooth(energies=EGRID, pars=pars, model=mvals)
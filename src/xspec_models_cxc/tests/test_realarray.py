@@ -7,18 +7,6 @@ import pytest
 import xspec_models_cxc as x
 
 
-# We need to set up the cosmology as this is currently not done in FNINIT.
-#
-x.cosmology(h0=70, lambda0=0.73, q0=0)
-
-# We want to ensure we have a fixed abundance / cross section
-# for the checks below. If we didn't set them here then it
-# would depend on the user's ~/.xspec/Xspec.init file
-#
-x.abundance('lodd')
-x.cross_section('vern')
-
-
 @pytest.mark.parametrize("arg", [[], 0])
 def test_create(arg):
     out = x.RealArray(arg)
@@ -129,10 +117,10 @@ def test_can_not_call_basic_interface():
 # What models do we want to run to check they match the
 # "basic" interface?
 #
-MODELS_ADD = [m for m in x.list_models(modeltype=x.ModelType.Add)
-              if x.info(m).language == x.LanguageStyle.CppStyle8]
-MODELS_MUL = [m for m in x.list_models(modeltype=x.ModelType.Mul)
-              if x.info(m).language == x.LanguageStyle.CppStyle8]
+MODELS_ADD = x.list_models(modeltype=x.ModelType.Add,
+                           language=x.LanguageStyle.CppStyle8)
+MODELS_MUL = x.list_models(modeltype=x.ModelType.Mul,
+                           language=x.LanguageStyle.CppStyle8)
 
 
 @pytest.mark.parametrize("models", [MODELS_ADD, MODELS_MUL])
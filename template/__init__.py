@@ -71,15 +71,17 @@ have said
 
     out = x.kdblur(ebergies=.., pars=.., model=ymodel.copy())
 
-which would keep the original model values (there is actualy a subtly
-in that the `model` argument must be sent the correct datatype for the
-convolution model - so either `np.float64` or `np.float32` - otherwise
-it will not be changed).
+which would keep the original model values. The `model` argument must
+be a contiguous array with the datatype used by the convolution model
+- so either `np.float64` or `np.float32` - otherwise a TypeError is
+raised, and a ValueError is raised if it is not writeable. The kdblur
+model uses `np.float32` so ymodel is converted:
 
 >>> kdblur = x.info('kdblur')
 >>> pars_kdblur = [p.default for p in kdblur.parameters]
->>> x.kdblur(energies=egrid, pars=pars_kdblur, model=ymodel)
->>> plt.plot(emid, ymodel, alpha=0.8, label='Convolved')
+>>> yconv = ymodel.astype(np.float32)
+>>> x.kdblur(energies=egrid, pars=pars_kdblur, model=yconv)
+>>> plt.plot(emid, yconv, alpha=0.8, label='Convolved')
 >>> plt.legend()
 
 XSPEC table models [TableModel]_ are fun to work with, as you
@@ -133,9 +135,11 @@ References
 
 from dataclasses import dataclass
 from enum import Enum, auto
+from functools import cache
 from importlib import resources
 import logging
 from pathlib import Path
+from types import MappingProxyType
 from typing import List, Sequence
 
 try:
@@ -179,7 +183,7 @@ class ParamType(Enum):
     Periodic = auto()
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class XSPECParameter:
     """An XSPEC parameter."""
 
@@ -196,7 +200,7 @@ class XSPECParameter:
     delta: float | None = None
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class XSPECModel:
     """An XSPEC model."""
 
@@ -210,7 +214,13 @@ class XSPECModel:
     use_errors: bool = False
     can_cache: bool = True
 
+    def __post_init__(self) -> None:
+        # Store the parameters as a tuple so that they can not be
+        # changed and the model can be hashed.
+        object.__setattr__(self, "parameters", tuple(self.parameters))
 
+
+@cache
 def get_include_path() -> Path:
     """Return the location of the C++ include file."""
 
@@ -221,10 +231,26 @@ def get_include_path() -> Path:
 # The model.dat file used to create this interface
 _model_dat = "@@MODELDAT@@"
 
-# Information on the supported models.
-_info = {
+# Information on the supported models. This is read only, as are the
+# XSPECModel and XSPECParameter values, since the tables below, and the
+# list_models cache, are created from it.
+_info = MappingProxyType({
 @@PYINFO@@
-    }
+    })
+
+# Look-up tables for info and list_models. We want case-insensitive
+# comparison but for the keys of _info to retain their case. Using
+# casefold() rather than lower() is a bit OTT here as I would bet
+# model.dat is meant to be US-ASCII.
+#
+_info_casefold = MappingProxyType({k.casefold(): v for k, v in _info.items()})
+
+_models_by_type = {mtype: frozenset(k for k, v in _info.items()
+                                    if v.modeltype == mtype)
+                   for mtype in ModelType}
+_models_by_language = {lang: frozenset(k for k, v in _info.items()
+                                       if v.language == lang)
+                       for lang in LanguageStyle}
 
 
 def info(model: str) -> XSPECModel:
@@ -260,17 +286,10 @@ def info(model: str) -> XSPECModel:
 
     """
 
-    # We want case-insensitive comparison but for the keys to retain
-    # their case. Using casefold() rather than lower() is a bit OTT
-    # here as I would bet model.dat is meant to be US-ASCII.
-    #
-    check = model.casefold()
-    out = next((v for k, v in _info.items() if k.casefold() == check),
-               None)
-    if out is None:
-        raise ValueError(f"Unrecognized XSPEC model '{model}'")
-
-    return out
+    try:
+        return _info_casefold[model.casefold()]
+    except KeyError:
+        raise ValueError(f"Unrecognized XSPEC model '{model}'") from None
 
 
 def list_models(modeltype: ModelType | None = None,
@@ -323,15 +342,25 @@ def list_models(modeltype: ModelType | None = None,
 
     """
 
-    out = set()
-    for k, v in _info.items():
+    # A new list is returned so the caller can change it.
+    return list(_list_models(modeltype, language))
+
 
-        if modeltype is not None and v.modeltype != modeltype:
-            continue
+@cache
+def _list_models(modeltype: ModelType | None,
+                 language: LanguageStyle | None
+                 ) -> tuple[str, ...]:
+    """The sorted model names for list_models.
+
+    The model information does not change, so the result for each
+    combination of arguments is cached.
+    """
 
-        if language is not None and v.language != language:
-            continue
+    out = frozenset(_info)
+    if modeltype is not None:
+        out &= _models_by_type.get(modeltype, frozenset())
 
-        out.add(k)
+    if language is not None:
+        out &= _models_by_language.get(language, frozenset())
 
-    return sorted(out)
+    return tuple(sorted(out))
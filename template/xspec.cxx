@@ -59,6 +59,11 @@ PYBIND11_MAKE_OPAQUE(RealArray);
 namespace py = pybind11;
 using namespace pybind11::literals;
 
+// The models may be split across several files, in which case they
+// are added by these routines.
+//
+@@REGISTERMODELS@@
+
 PYBIND11_MODULE(_compiled, m) {
 #ifdef VERSION_INFO
     m.attr("__version__") = MACRO_STRINGIFY(VERSION_INFO);
@@ -170,9 +175,12 @@ Convolution models
     // by this routine is created on-the-fly and so I think it's
     // okay for pybind11 to take ownership if it.
     //
+    // The library_guard ensures the library is initialized and that
+    // no model is being evaluated by another thread (the models are
+    // evaluated with the GIL released).
     //
     m.def("get_version",
-	  []() { xspec_models_cxc::init(); return XSutility::xs_version(); },
+	  []() { xspec_models_cxc::library_guard guard; return XSutility::xs_version(); },
 	  "The version of the XSPEC model library");
 
     // You could be fancy and have an XSPEC object where these
@@ -187,23 +195,23 @@ Convolution models
     //
 
     m.def("chatter",
-	  []() { xspec_models_cxc::init(); return FunctionUtility::xwriteChatter(); },
+	  []() { xspec_models_cxc::library_guard guard; return FunctionUtility::xwriteChatter(); },
 	  "Get the XSPEC chatter level.");
 
     m.def("chatter",
-	  [](int i) { xspec_models_cxc::init(); FunctionUtility::xwriteChatter(i); },
+	  [](int i) { xspec_models_cxc::library_guard guard; FunctionUtility::xwriteChatter(i); },
 	  "Set the XSPEC chatter level.",
 	  "chatter"_a);
 
     // Abundances
     //
     m.def("abundance",
-	  []() { xspec_models_cxc::init(); return FunctionUtility::ABUND(); },
+	  []() { xspec_models_cxc::library_guard guard; return FunctionUtility::ABUND(); },
 	  "Get the abundance-table setting.",
 	  py::return_value_policy::reference);
 
     m.def("abundance",
-	  [](const string& value) { xspec_models_cxc::init(); return FunctionUtility::ABUND(value); },
+	  [](const string& value) { xspec_models_cxc::library_guard guard; return FunctionUtility::ABUND(value); },
 	  "Set the abundance-table setting.",
 	  "table"_a);
 
@@ -212,7 +220,7 @@ Convolution models
     //
     m.def("elementAbundance",
 	  [](const string& value) {
-	    xspec_models_cxc::init();
+	    xspec_models_cxc::library_guard guard;
 
 	    std::ostringstream local;
 	    auto cerr_buff = std::cerr.rdbuf();
@@ -232,7 +240,7 @@ Convolution models
 
     m.def("elementAbundance",
 	  [](const size_t Z) {
-	    xspec_models_cxc::init();
+	    xspec_models_cxc::library_guard guard;
 	    if (Z < 1 || Z > FunctionUtility::NELEMS()) {
 	      std::ostringstream emsg;
 	      emsg << Z;
@@ -245,7 +253,7 @@ Convolution models
 	  "z"_a);
 
     m.def("elementName",
-	  [](const size_t Z) { xspec_models_cxc::init(); return FunctionUtility::elements(Z - 1); },
+	  [](const size_t Z) { xspec_models_cxc::library_guard guard; return FunctionUtility::elements(Z - 1); },
 	  "Return the name of an element given the atomic number.",
 	  "z"_a,
 	  py::return_value_policy::reference);
@@ -258,12 +266,12 @@ Convolution models
     // Cross sections
     //
     m.def("cross_section",
-	  []() { xspec_models_cxc::init(); return FunctionUtility::XSECT(); },
+	  []() { xspec_models_cxc::library_guard guard; return FunctionUtility::XSECT(); },
 	  "Get the cross-section-table setting.",
 	  py::return_value_policy::reference);
 
     m.def("cross_section",
-	  [](const string& value) { xspec_models_cxc::init(); return FunctionUtility::XSECT(value); },
+	  [](const string& value) { xspec_models_cxc::library_guard guard; return FunctionUtility::XSECT(value); },
 	  "Set the cross-section-table setting.",
 	  "table"_a);
 
@@ -271,7 +279,7 @@ Convolution models
     //
     m.def("cosmology",
 	  []() {
-	    xspec_models_cxc::init();
+	    xspec_models_cxc::library_guard guard;
 	    std::map<std::string, float> answer;
 	    answer["h0"] = FunctionUtility::getH0();
 	    answer["q0"] = FunctionUtility::getq0();
@@ -282,7 +290,7 @@ Convolution models
 
     m.def("cosmology",
 	  [](float h0, float q0, float lambda0) {
-	    xspec_models_cxc::init();
+	    xspec_models_cxc::library_guard guard;
 	    FunctionUtility::setH0(h0);
 	    FunctionUtility::setq0(q0);
 	    FunctionUtility::setlambda0(lambda0);
@@ -295,42 +303,42 @@ Convolution models
     // the values, and then leave the rest to the user to do in Python.
     //
     m.def("clearXFLT",
-	  []() { xspec_models_cxc::init(); return FunctionUtility::clearXFLT(); },
+	  []() { xspec_models_cxc::library_guard guard; return FunctionUtility::clearXFLT(); },
 	  "Clear the XFLT database for all spectra.");
 
     m.def("getNumberXFLT",
-	  [](int ifl) { xspec_models_cxc::init(); return FunctionUtility::getNumberXFLT(ifl); },
+	  [](int ifl) { xspec_models_cxc::library_guard guard; return FunctionUtility::getNumberXFLT(ifl); },
 	  "How many XFLT keywords are defined for the spectrum?",
 	  "spectrum"_a=1);
 
     m.def("getXFLT",
-	  [](int ifl) { xspec_models_cxc::init(); return FunctionUtility::getAllXFLT(ifl); },
+	  [](int ifl) { xspec_models_cxc::library_guard guard; return FunctionUtility::getAllXFLT(ifl); },
 	  "What are all the XFLT keywords for the spectrum?",
 	  "spectrum"_a=1,
 	  py::return_value_policy::reference);
 
     m.def("getXFLT",
-	  [](int ifl, int i) { xspec_models_cxc::init(); return FunctionUtility::getXFLT(ifl, i); },
+	  [](int ifl, int i) { xspec_models_cxc::library_guard guard; return FunctionUtility::getXFLT(ifl, i); },
 	  "Return the given XFLT key.",
 	  "spectrum"_a, "key"_a);
 
     m.def("getXFLT",
-	  [](int ifl, string skey) { xspec_models_cxc::init(); return FunctionUtility::getXFLT(ifl, skey); },
+	  [](int ifl, string skey) { xspec_models_cxc::library_guard guard; return FunctionUtility::getXFLT(ifl, skey); },
 	  "Return the given XFLT name.",
 	  "spectrum"_a, "name"_a);
 
     m.def("inXFLT",
-	  [](int ifl, int i) { xspec_models_cxc::init(); return FunctionUtility::inXFLT(ifl, i); },
+	  [](int ifl, int i) { xspec_models_cxc::library_guard guard; return FunctionUtility::inXFLT(ifl, i); },
 	  "Is the given XFLT key set?",
 	  "spectrum"_a, "key"_a);
 
     m.def("inXFLT",
-	  [](int ifl, string skey) { xspec_models_cxc::init(); return FunctionUtility::inXFLT(ifl, skey); },
+	  [](int ifl, string skey) { xspec_models_cxc::library_guard guard; return FunctionUtility::inXFLT(ifl, skey); },
 	  "Is the given XFLT name set?.",
 	  "spectrum"_a, "name"_a);
 
     m.def("setXFLT",
-	  [](int ifl, const std::map<string, Real>& values) { xspec_models_cxc::init(); FunctionUtility::loadXFLT(ifl, values); },
+	  [](int ifl, const std::map<string, Real>& values) { xspec_models_cxc::library_guard guard; FunctionUtility::loadXFLT(ifl, values); },
 	  "Set the XFLT keywords for a spectrum",
 	  "spectrum"_a, "values"_a);
 
@@ -339,17 +347,17 @@ Convolution models
     // What are the memory requirements?
     //
     m.def("clearModelString",
-	  []() { xspec_models_cxc::init(); return FunctionUtility::eraseModelStringDataBase(); },
+	  []() { xspec_models_cxc::library_guard guard; return FunctionUtility::eraseModelStringDataBase(); },
 	  "Clear the model string database.");
 
     m.def("getModelString",
-	  []() { xspec_models_cxc::init(); return FunctionUtility::modelStringDataBase(); },
+	  []() { xspec_models_cxc::library_guard guard; return FunctionUtility::modelStringDataBase(); },
 	  "Get the model string database.",
 	  py::return_value_policy::reference);
 
     m.def("getModelString",
 	  [](const string& key) {
-	    xspec_models_cxc::init();
+	    xspec_models_cxc::library_guard guard;
 	    auto answer = FunctionUtility::getModelString(key);
 	    if (answer == FunctionUtility::NOT_A_KEY())
 	      throw pybind11::key_error(key);
@@ -359,7 +367,7 @@ Convolution models
 	  "key"_a);
 
     m.def("setModelString",
-	  [](const string& key, const string& value) { xspec_models_cxc::init(); FunctionUtility::setModelString(key, value); },
+	  [](const string& key, const string& value) { xspec_models_cxc::library_guard guard; FunctionUtility::setModelString(key, value); },
 	  "Get the key from the model string database.",
 	  "key"_a, "value"_a);
 
@@ -367,11 +375,11 @@ Convolution models
     // Python.
     //
     m.def("clearDb",
-	  []() { xspec_models_cxc::init(); return FunctionUtility::clearDb(); },
+	  []() { xspec_models_cxc::library_guard guard; return FunctionUtility::clearDb(); },
 	  "Clear the keyword database.");
 
     m.def("getDb",
-	  []() { xspec_models_cxc::init(); return FunctionUtility::getAllDbValues(); },
+	  []() { xspec_models_cxc::library_guard guard; return FunctionUtility::getAllDbValues(); },
 	  "Get the keyword database.",
 	  py::return_value_policy::reference);
 
@@ -380,7 +388,7 @@ Convolution models
     //
     m.def("getDb",
 	  [](const string keyword) {
-	    xspec_models_cxc::init();
+	    xspec_models_cxc::library_guard guard;
 
 	    std::ostringstream local;
 	    auto cerr_buff = std::cerr.rdbuf();
@@ -399,7 +407,7 @@ Convolution models
 	  "keyword"_a);
 
     m.def("setDb",
-	  [](const string keyword, const double value) { xspec_models_cxc::init(); FunctionUtility::loadDbValue(keyword, value); },
+	  [](const string keyword, const double value) { xspec_models_cxc::library_guard guard; FunctionUtility::loadDbValue(keyword, value); },
 	  "Set the keyword in the database to the given value.",
 	  "keyword"_a, "value"_a);
 
@@ -433,9 +441,13 @@ Convolution models
 	    float *optr = static_cast<float *>(obuf.ptr);
 
 	    xspec_models_cxc::init();
-	    tabint(eptr, nelem, pptr, pbuf.size,
-		   filename.c_str(), spectrumNumber,
-		   tableType.c_str(), optr, errors.data());
+	    {
+	      py::gil_scoped_release release;
+	      std::lock_guard<std::mutex> lock(xspec_models_cxc::xspec_mutex());
+	      tabint(eptr, nelem, pptr, pbuf.size,
+		     filename.c_str(), spectrumNumber,
+		     tableType.c_str(), optr, errors.data());
+	    }
 	    return result;
 	  },
 	  "XSPEC table model.",
@@ -471,9 +483,13 @@ Convolution models
 	    float *optr = static_cast<float *>(obuf.ptr);
 
 	    xspec_models_cxc::init();
-	    tabint(eptr, nelem, pptr, pbuf.size,
-		   filename.c_str(), spectrumNumber,
-		   tableType.c_str(), optr, errors.data());
+	    {
+	      py::gil_scoped_release release;
+	      std::lock_guard<std::mutex> lock(xspec_models_cxc::xspec_mutex());
+	      tabint(eptr, nelem, pptr, pbuf.size,
+		     filename.c_str(), spectrumNumber,
+		     tableType.c_str(), optr, errors.data());
+	    }
 	    return output;
 	  },
 	  "XSPEC table model; inplace.",
@@ -0,0 +1,44 @@
+//  Copyright (C) 2007, 2015-2018, 2019, 2020, 2021, 2022, 2023
+//  Smithsonian Astrophysical Observatory
+//
+// SPDX-License-Identifier: GPL-3.0-or-later
+//
+
+// Bind a subset of the models. The models are split across several
+// files, rather than all being added in xspec.cxx, to reduce the time
+// and memory needed to compile the module.
+//
+
+#include <pybind11/pybind11.h>
+#include <pybind11/stl.h>
+#include <pybind11/numpy.h>
+
+#include <xsTypes.h>
+#include <XSFunctions/Utilities/funcType.h>  // xsccCall and the like
+
+#include <XSFunctions/Utilities/xsFortran.h>
+
+#include <XSFunctions/functionMap.h>
+#include <XSFunctions/funcWrappers.h>
+
+// templates for binding the models
+//
+#include "xspec_models_cxc.hh"
+
+
+// This must match the setting in xspec.cxx.
+//
+PYBIND11_MAKE_OPAQUE(RealArray);
+
+namespace py = pybind11;
+using namespace pybind11::literals;
+
+namespace xspec_models_cxc {
+
+void register_models_@@SHARD@@(py::module_ &m) {
+
+@@MODELS@@
+
+}
+
+} // namespace: xspec_models_cxc